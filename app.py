@@ -1,17 +1,27 @@
 import os
+import threading
+import time
 from datetime import datetime
 from functools import wraps
 
-from flask import Flask, flash, redirect, render_template, request, session, url_for
+from flask import Flask, flash, g, make_response, redirect, render_template, request, session, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 app.config.update(
     SECRET_KEY=os.environ.get("MARUBIYA_SECRET_KEY", "change-me"),
-    SQLALCHEMY_DATABASE_URI="sqlite:///site.db",
+    SQLALCHEMY_DATABASE_URI=os.environ.get("MARUBIYA_DATABASE_URI", "sqlite:///site.db"),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    ADMISSION_MAX_IN_FLIGHT=int(os.environ.get("MARUBIYA_MAX_IN_FLIGHT", "8")),
+    ADMISSION_ADMIN_MAX_IN_FLIGHT=int(os.environ.get("MARUBIYA_ADMIN_MAX_IN_FLIGHT", "2")),
+    ADMISSION_PUBLIC_WAIT_SECONDS=0.5,
+    ADMISSION_ADMIN_WAIT_SECONDS=5.0,
+    ADMISSION_RETRY_AFTER_SECONDS=5,
+    PAGE_CACHE_FRESH_SECONDS=float(os.environ.get("MARUBIYA_PAGE_CACHE_FRESH_SECONDS", "5")),
+    PAGE_CACHE_MAX_STALE_SECONDS=float(os.environ.get("MARUBIYA_PAGE_CACHE_MAX_STALE_SECONDS", "600")),
 )
 
 app.config["UPLOAD_FOLDER"] = os.path.join(app.static_folder, "images", "uploads")
@@ -447,6 +457,85 @@ SITE_CONTENT_SCHEMA = [
 HERO_IMAGE_KEY = "hero_image"
 HERO_IMAGE_DEFAULT = "images/exterior.svg"
 
+# Public pages are admitted ahead of admin work and their last render is kept.
+PUBLIC_ENDPOINTS = {"index", "gallery"}
+
+
+class AdmissionController:
+    """Caps in-flight requests that touch the database.
+
+    Public pages always go ahead of waiting admin requests, and admin requests
+    may only hold a limited share of the slots so a traffic spike on the top
+    page is never starved by dashboard work.
+    """
+
+    def __init__(self, max_in_flight: int, admin_max_in_flight: int) -> None:
+        self.max_in_flight = max(1, max_in_flight)
+        self.admin_max_in_flight = max(1, min(admin_max_in_flight, self.max_in_flight))
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._admin_in_flight = 0
+        self._public_waiting = 0
+        self._counters = {"admitted": 0, "shed": 0, "stale_served": 0}
+
+    def _can_admit(self, public: bool) -> bool:
+        if self._in_flight >= self.max_in_flight:
+            return False
+        if public:
+            return True
+        return self._public_waiting == 0 and self._admin_in_flight < self.admin_max_in_flight
+
+    def acquire(self, public: bool, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if public:
+                self._public_waiting += 1
+            try:
+                while not self._can_admit(public):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self._in_flight += 1
+                if not public:
+                    self._admin_in_flight += 1
+                self._counters["admitted"] += 1
+                return True
+            finally:
+                if public:
+                    self._public_waiting -= 1
+
+    def release(self, public: bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if not public:
+                self._admin_in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, name: str) -> None:
+        with self._condition:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def stats(self) -> dict[str, int]:
+        with self._condition:
+            return {
+                **self._counters,
+                "in_flight": self._in_flight,
+                "admin_in_flight": self._admin_in_flight,
+                "max_in_flight": self.max_in_flight,
+            }
+
+
+admission = AdmissionController(
+    app.config["ADMISSION_MAX_IN_FLIGHT"],
+    app.config["ADMISSION_ADMIN_MAX_IN_FLIGHT"],
+)
+
+_page_cache: dict[str, tuple[str, float, int]] = {}
+_page_cache_generation = 0
+_page_cache_revalidating: set[str] = set()
+_page_cache_lock = threading.Lock()
+
 
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -503,6 +592,97 @@ def seed_defaults() -> None:
     db.session.commit()
 
 
+def get_cached_page(endpoint: str) -> tuple[str, float, bool] | None:
+    with _page_cache_lock:
+        entry = _page_cache.get(endpoint)
+        generation = _page_cache_generation
+    if entry is None:
+        return None
+    html, rendered_at, rendered_generation = entry
+    age = time.monotonic() - rendered_at
+    if age > app.config["PAGE_CACHE_MAX_STALE_SECONDS"]:
+        return None
+    fresh = rendered_generation == generation and age < app.config["PAGE_CACHE_FRESH_SECONDS"]
+    return html, age, fresh
+
+
+def get_page_cache_generation() -> int:
+    with _page_cache_lock:
+        return _page_cache_generation
+
+
+def store_cached_page(endpoint: str, html: str, generation: int) -> None:
+    with _page_cache_lock:
+        # A render that started before the cache was cleared may hold old rows.
+        if generation != _page_cache_generation:
+            return
+        _page_cache[endpoint] = (html, time.monotonic(), generation)
+
+
+def expire_page_cache() -> None:
+    """Mark every cached page as stale after public content has changed.
+
+    The old HTML is kept so that one request re-renders while the others,
+    and any request shed or hit by a database error, still get a page.
+    """
+    global _page_cache_generation
+    with _page_cache_lock:
+        _page_cache_generation += 1
+
+
+def claim_revalidation(endpoint: str) -> bool:
+    with _page_cache_lock:
+        if endpoint in _page_cache_revalidating:
+            return False
+        _page_cache_revalidating.add(endpoint)
+        return True
+
+
+def finish_revalidation(endpoint: str) -> None:
+    with _page_cache_lock:
+        _page_cache_revalidating.discard(endpoint)
+
+
+def cached_page_response(html: str, age: float):
+    response = make_response(html)
+    response.headers["Age"] = str(int(age))
+    return response
+
+
+def serve_stale_page(cached: tuple[str, float, bool]):
+    html, age, _ = cached
+    admission.record("stale_served")
+    return cached_page_response(html, age)
+
+
+def overloaded_response():
+    response = make_response("ただいまアクセスが集中しています。しばらくしてから再度お試しください。", 503)
+    response.headers["Retry-After"] = str(app.config["ADMISSION_RETRY_AFTER_SECONDS"])
+    return response
+
+
+def serve_stale_on_error(view):
+    @wraps(view)
+    def wrapped_view(**kwargs):
+        endpoint = request.endpoint
+        has_flashes = "_flashes" in session
+        generation = get_page_cache_generation()
+        try:
+            html = view(**kwargs)
+        except SQLAlchemyError:
+            cached = get_cached_page(endpoint)
+            if cached is None:
+                raise
+            app.logger.exception("Serving stale %s after database error", endpoint)
+            return serve_stale_page(cached)
+        # Pages that displayed flash messages are specific to one visitor.
+        if isinstance(html, str) and not has_flashes:
+            store_cached_page(endpoint, html, generation)
+        return html
+
+    return wrapped_view
+
+
 def login_required(view):
     @wraps(view)
     def wrapped_view(**kwargs):
@@ -514,12 +694,59 @@ def login_required(view):
     return wrapped_view
 
 
+@app.before_request
+def admit_request():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == "static":
+        return None
+
+    public = endpoint in PUBLIC_ENDPOINTS
+    cached = get_cached_page(endpoint) if public and request.method == "GET" else None
+
+    if cached and "_flashes" not in session:
+        html, age, fresh = cached
+        if fresh:
+            return cached_page_response(html, age)
+        # Stale-while-revalidate: one request re-renders, the rest get the stale page now.
+        if not claim_revalidation(endpoint):
+            return serve_stale_page(cached)
+        if not admission.acquire(public, 0):
+            finish_revalidation(endpoint)
+            return serve_stale_page(cached)
+        g.admission_public = public
+        g.revalidating_endpoint = endpoint
+        return None
+
+    timeout = app.config["ADMISSION_PUBLIC_WAIT_SECONDS" if public else "ADMISSION_ADMIN_WAIT_SECONDS"]
+    if not admission.acquire(public, timeout):
+        if cached:
+            return serve_stale_page(cached)
+        admission.record("shed")
+        app.logger.warning("Shed %s request to %s under load", request.method, request.path)
+        return overloaded_response()
+
+    g.admission_public = public
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    revalidating_endpoint = g.pop("revalidating_endpoint", None)
+    if revalidating_endpoint is not None:
+        finish_revalidation(revalidating_endpoint)
+    public = g.pop("admission_public", None)
+    if public is None:
+        return
+    admission.release(public)
+
+
 @app.context_processor
 def inject_site_content():
     return {"site_content": get_site_content()}
 
 
 @app.route("/")
+@serve_stale_on_error
 def index():
     content = get_site_content()
     instagram_enabled = content.get("instagram_button_enabled", "false").lower() == "true"
@@ -535,6 +762,7 @@ def index():
 
 
 @app.route("/gallery")
+@serve_stale_on_error
 def gallery():
     images = GalleryImage.query.order_by(GalleryImage.created_at.desc()).all()
     return render_template("gallery.html", gallery_images=images)
@@ -580,6 +808,7 @@ def admin_dashboard():
                             {"value": request.form.get(key, "").strip()}
                         )
             db.session.commit()
+            expire_page_cache()
             flash("サイト文章を更新しました。", "success")
             return redirect(url_for("admin_dashboard"))
 
@@ -594,6 +823,7 @@ def admin_dashboard():
                     old_path = current.value if current else HERO_IMAGE_DEFAULT
                     SiteContent.query.filter_by(key=HERO_IMAGE_KEY).update({"value": saved_path})
                     db.session.commit()
+                    expire_page_cache()
                     if old_path and old_path.startswith("images/uploads/"):
                         old_file = os.path.join(app.static_folder, old_path)
                         if os.path.exists(old_file):
@@ -613,6 +843,7 @@ def admin_dashboard():
                 if saved_path and caption:
                     db.session.add(GalleryImage(filename=saved_path, caption=caption))
                     db.session.commit()
+                    expire_page_cache()
                     flash("ギャラリー画像を追加しました。", "success")
                 else:
                     flash("画像とキャプションを入力してください。", "danger")
@@ -625,6 +856,7 @@ def admin_dashboard():
                 image_path = os.path.join(app.static_folder, image.filename)
                 db.session.delete(image)
                 db.session.commit()
+                expire_page_cache()
                 if image.filename.startswith("images/uploads/") and os.path.exists(image_path):
                     os.remove(image_path)
                 flash("ギャラリー画像を削除しました。", "info")
@@ -655,6 +887,7 @@ def admin_dashboard():
         schema=SITE_CONTENT_SCHEMA,
         hero_image=url_for("static", filename=content.get(HERO_IMAGE_KEY, HERO_IMAGE_DEFAULT)),
         gallery_images=gallery_images,
+        admission_stats=admission.stats(),
     )
 
 
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MARUBIYA_DATABASE_URI", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as marubiya  # noqa: E402
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    monkeypatch.setattr(marubiya, "admission", marubiya.AdmissionController(8, 2))
+    marubiya._page_cache.clear()
+    marubiya._page_cache_revalidating.clear()
+    marubiya.app.config["TESTING"] = True
+    yield marubiya
+    marubiya._page_cache.clear()
+    marubiya._page_cache_revalidating.clear()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
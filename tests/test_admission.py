@@ -0,0 +1,185 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import AdmissionController
+
+
+def test_public_is_admitted_ahead_of_waiting_admin():
+    controller = AdmissionController(1, 1)
+    assert controller.acquire(True, 0)
+    order = []
+
+    def worker(public, name):
+        if controller.acquire(public, 5):
+            order.append(name)
+            controller.release(public)
+
+    admin = threading.Thread(target=worker, args=(False, "admin"))
+    admin.start()
+    public = threading.Thread(target=worker, args=(True, "public"))
+    public.start()
+    deadline = time.monotonic() + 5
+    while controller._public_waiting != 1:
+        assert time.monotonic() < deadline, "public request never started waiting"
+        time.sleep(0.001)
+    controller.release(True)
+    admin.join()
+    public.join()
+
+    assert order == ["public", "admin"]
+
+
+def test_admin_share_cap_holds():
+    controller = AdmissionController(3, 1)
+    assert controller.acquire(False, 0)
+    assert not controller.acquire(False, 0.01)
+    assert controller.acquire(True, 0)
+    assert controller.stats()["admin_in_flight"] == 1
+
+
+def test_shed_returns_503_when_nothing_is_cached(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.admission, "acquire", lambda public, timeout: False)
+
+    response = client.get("/")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app_module.app.config["ADMISSION_RETRY_AFTER_SECONDS"])
+    stats = app_module.admission.stats()
+    assert stats["shed"] == 1
+    assert stats["stale_served"] == 0
+
+
+def test_stale_page_is_served_when_admission_times_out(app_module, client, monkeypatch):
+    fresh = client.get("/")
+    assert "Age" not in fresh.headers
+    monkeypatch.setitem(app_module.app.config, "PAGE_CACHE_FRESH_SECONDS", 0)
+    monkeypatch.setattr(app_module.admission, "acquire", lambda public, timeout: False)
+
+    response = client.get("/")
+
+    assert response.status_code == 200
+    assert "Age" in response.headers
+    assert response.data == fresh.data
+    stats = app_module.admission.stats()
+    assert stats["stale_served"] == 1
+    assert stats["shed"] == 0
+
+
+def test_only_one_request_revalidates_a_stale_page(app_module, client, monkeypatch):
+    client.get("/gallery")
+    monkeypatch.setitem(app_module.app.config, "PAGE_CACHE_FRESH_SECONDS", 0)
+    assert app_module.claim_revalidation("gallery")
+
+    def fail_acquire(public, timeout):
+        raise AssertionError("stale requests must not wait for admission")
+
+    monkeypatch.setattr(app_module.admission, "acquire", fail_acquire)
+
+    response = client.get("/gallery")
+
+    assert response.status_code == 200
+    assert "Age" in response.headers
+
+
+def test_stale_page_is_served_after_database_error(app_module, client, monkeypatch):
+    fresh = client.get("/")
+    monkeypatch.setitem(app_module.app.config, "PAGE_CACHE_FRESH_SECONDS", 0)
+
+    def broken_site_content():
+        raise OperationalError("SELECT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(app_module, "get_site_content", broken_site_content)
+
+    response = client.get("/")
+
+    assert response.status_code == 200
+    assert "Age" in response.headers
+    assert response.data == fresh.data
+    assert app_module.admission.stats()["stale_served"] == 1
+
+
+def test_stale_page_is_not_served_past_max_stale(app_module, client, monkeypatch):
+    client.get("/")
+    monkeypatch.setitem(app_module.app.config, "PAGE_CACHE_FRESH_SECONDS", 0)
+    monkeypatch.setitem(app_module.app.config, "PAGE_CACHE_MAX_STALE_SECONDS", 0)
+
+    def broken_site_content():
+        raise OperationalError("SELECT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(app_module, "get_site_content", broken_site_content)
+
+    with pytest.raises(OperationalError):
+        client.get("/")
+
+
+def log_in(app_module, client):
+    with app_module.app.app_context():
+        admin_id = app_module.AdminUser.query.first().id
+    with client.session_transaction() as session:
+        session["admin_user_id"] = admin_id
+
+
+def test_admin_content_update_expires_page_cache(app_module, client):
+    before = client.get("/")
+    log_in(app_module, client)
+
+    response = client.post("/admin", data={"form_name": "site_content", "hero_tag": "臨時休業のお知らせ"})
+
+    assert response.status_code == 302
+    html, _, fresh = app_module.get_cached_page("index")
+    assert not fresh
+    assert html == before.get_data(as_text=True)
+    client.get("/admin")  # consume the flash message
+    assert "臨時休業のお知らせ" in client.get("/").get_data(as_text=True)
+
+
+def test_expired_page_is_served_while_another_request_revalidates(app_module, client):
+    before = client.get("/")
+    app_module.expire_page_cache()
+    assert app_module.claim_revalidation("index")
+
+    response = client.get("/")
+
+    assert "Age" in response.headers
+    assert response.data == before.data
+
+
+def test_failed_login_keeps_page_cache(app_module, client):
+    client.get("/")
+
+    client.post("/admin/login", data={"username": "admin", "password": "wrong"})
+    client.post("/admin", data={"form_name": "site_content", "hero_tag": "x"})
+
+    assert app_module.get_cached_page("index")[2]
+
+
+def test_password_change_keeps_page_cache(app_module, client):
+    client.get("/")
+    log_in(app_module, client)
+
+    client.post(
+        "/admin",
+        data={
+            "form_name": "update_password",
+            "current_password": "admin123",
+            "new_password": "new-password",
+            "confirm_password": "new-password",
+        },
+    )
+
+    assert app_module.get_cached_page("index")[2]
+
+
+def test_render_started_before_expiry_is_not_stored(app_module):
+    app_module.store_cached_page("index", "<p>current</p>", app_module.get_page_cache_generation())
+    generation = app_module.get_page_cache_generation()
+    app_module.expire_page_cache()
+
+    app_module.store_cached_page("index", "<p>old</p>", generation)
+
+    html, _, fresh = app_module.get_cached_page("index")
+    assert html == "<p>current</p>"
+    assert not fresh